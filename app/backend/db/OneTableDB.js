@@ -25,17 +25,23 @@ class OneTableDB extends DatabaseInterface {
 
     /**
      * Get the CN, convert to string array of just numbers, and return
+     * Named queries are prepared once per pooled connection, so repeat
+     * calls skip parsing and planning on the server.
      * @param {Number[]} factors - Prime factors to perform divisibility test on.
      * @returns {Promise<String[]>} result - The results CN or empty if no matches.
      */
     async getCarmichaelNumber(factors) {
-        const query = `
-            SELECT number
-            FROM carmichael_number
-            WHERE factors @> $1;
-        `;
+        const query = {
+            name: 'get-carmichael-number',
+            text: `
+                SELECT number
+                FROM carmichael_number
+                WHERE factors @> $1;
+            `,
+            values: [factors]
+        };
 
-        const query_result = await this.#pool.query(query, [factors]);
+        const query_result = await this.#pool.query(query);
         if (query_result.rows.length === 0) return [];
         
         let cm_numbers = [];
@@ -52,13 +58,17 @@ class OneTableDB extends DatabaseInterface {
      * @returns {Promise<Number[]>} Array of factors for the CN 
      */
     async getFactors(carmichael_number) {
-        const query = `
-            SELECT factors
-            FROM carmichael_number
-            WHERE number = $1
-        `;
+        const query = {
+            name: 'get-factors',
+            text: `
+                SELECT factors
+                FROM carmichael_number
+                WHERE number = $1
+            `,
+            values: [carmichael_number]
+        };
 
-        const query_result = await this.#pool.query(query, [carmichael_number]);
+        const query_result = await this.#pool.query(query);
         if (query_result.rows.length === 0) return [];
 
         return query_result.rows[0]['factors'].map(x => Number(x));
@@ -35,8 +35,10 @@ const db = new DBInterface({
 });
 
 const MAX_CACHE_SIZE = 5 * 1024 * 1024 * 1024           // 5GB Cache
+const MAX_FACTORS_CACHE_SIZE = 100 * 1024 * 1024        // 100MB Cache, factor lists are short
 const LimitedCache = require('./utils/LimitedCache');
 const query_cache = new LimitedCache(MAX_CACHE_SIZE);
+const factors_cache = new LimitedCache(MAX_FACTORS_CACHE_SIZE);
 
 const express = require('express');
 const cors = require('cors');
@@ -192,7 +194,19 @@ app.get('/api/factors', async (req, res) => {
         if (!validateStringInput(input_string)) throw new Error("Not a string 'carmichael number' parameter");
         if (!/^\d+$/.test(input_string)) throw new Error("Non-numeric 'carmichael number' parameter");
 
-        const factors = await db.getFactors(input_string);
+        // Leading zeros don't change the number, so they don't get their own cache entry
+        const cache_key = input_string.replace(/^0+(?=\d)/, '');
+
+        // Check cache
+        let factors;
+        if (factors_cache.has(cache_key)) {
+            console.log(`Cache HIT for number: ${cache_key}`);
+            factors = factors_cache.get(cache_key);
+        } else { // Query if not in cache.
+            console.log(`Cache MISS for number: ${cache_key}`);
+            factors = await db.getFactors(cache_key);
+            factors_cache.set(cache_key, factors);
+        }
 
         res.json({
             success: true,
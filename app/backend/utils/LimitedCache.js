@@ -19,11 +19,12 @@ class LimitedCache {
 
     /**
      * Estimate the size by using a factor of 100 based on each element in the array.
+     * The extra element accounts for the key and entry, so empty results still take up room.
      * @param {String[]} data - A string array representing query results.
      * @returns The estimated size of the array as a number.
      */
     #estimateSize(data_array) {
-        return data_array.length * 100;
+        return (data_array.length + 1) * 100;
     }
 
     /**
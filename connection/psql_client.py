@@ -1,13 +1,18 @@
-import subprocess
 import os
-from typing import Optional, Dict
+from io import StringIO
+from typing import Optional
+
+import psycopg2
+from psycopg2.pool import AbstractConnectionPool
 
 class PSQLClient:
     """
-    A client for executing PostgreSQL commands via subprocess using the psql CLI tool.
+    A client for executing PostgreSQL commands over a persistent psycopg2 connection.
 
-    This class abstracts away subprocess commands to connect to and interact with
+    This class abstracts away the connection handling to connect to and interact with
     a PostgreSQL database, providing methods for queries and bulk inserts.
+    The connection is opened on first use and reused by every call after it.
+    If that connection is lost, calls raise rather than quietly reconnecting.
     """
 
     def __init__(
@@ -16,7 +21,8 @@ class PSQLClient:
         database: Optional[str] = None,
         user: Optional[str] = None,
         password: Optional[str] = None,
-        port: Optional[str] = None
+        port: Optional[str] = None,
+        pool: Optional[AbstractConnectionPool] = None
     ):
         """
         Initialize the PostgreSQL client with connection parameters.
@@ -27,6 +33,8 @@ class PSQLClient:
             user: Database user. If None, reads from PQ_USER environment variable.
             password: Database password. If None, reads from PQ_USER_PASSWORD environment variable.
             port: Database port. If None, reads from PQ_PORT environment variable.
+            pool: Optional connection pool. If set, the connection is checked out
+                of the pool and handed back on close instead of opened directly.
         """
         self.host = host or os.getenv('HOST')
         self.database = database or os.getenv('DATABASE')
@@ -35,6 +43,23 @@ class PSQLClient:
         self.port = port or os.getenv('PQ_PORT')
 
         self._validate_connection_params()
+        self._pool = pool
+        self._conn = None
+
+        # Built once here and reused on every (re)connect; treat as read-only
+        self._connect_kwargs = {
+            'host': self.host,
+            'dbname': self.database,
+            'user': self.user,
+            'password': self.password or None,
+            'port': self.port
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def _validate_connection_params(self):
         """Validate that all required connection parameters are set."""
@@ -53,66 +78,99 @@ class PSQLClient:
                 "Provide them as arguments or set environment variables."
             )
 
-    def _build_base_command(self) -> list:
-        """Build the base psql command with connection parameters."""
-        return [
-            'psql',
-            '-h', self.host,
-            '-U', self.user,
-            '-d', self.database,
-            '-p', self.port
-        ]
-
-    def _get_env_with_password(self) -> Dict[str, str]:
-        """Get environment dict with PGPASSWORD set if password is available."""
-        env = os.environ.copy()
-        if self.password:
-            env['PGPASSWORD'] = self.password
-        return env
-
-    def execute_query(
-        self,
-        query: str,
-        input_data: Optional[str] = None,
-        tuples_only: bool = True,
-        unaligned: bool = True
-    ) -> str:
+    def _get_connection(self):
         """
-        Execute a SQL query using psql command-line tool.
+        Open the connection on first use, then keep handing back the same one.
+        Autocommit mirrors psql -c, where every statement is its own transaction.
+
+        Raises:
+            psycopg2.InterfaceError: If the open connection was lost. Reconnecting
+                silently would drop the session's state (prepared statements, SET
+                parameters), so the caller has to decide, calling close() first
+                to start over on a new session.
+        """
+        if self._conn is not None and self._conn.closed:
+            raise psycopg2.InterfaceError(
+                "The connection was closed unexpectedly and its session state is lost. "
+                "Call close() before reusing this client."
+            )
+        if self._conn is None:
+            if self._pool is not None:
+                self._conn = self._pool.getconn()
+            else:
+                self._conn = psycopg2.connect(**self._connect_kwargs)
+            self._conn.autocommit = True
+        return self._conn
+
+    @staticmethod
+    def _format_rows(cursor) -> str:
+        """
+        Format a result set the way psql -t -A prints it:
+        one line per row and columns separated by '|'.
+        """
+        if cursor.description is None:
+            return ''
+        return '\n'.join(
+            '|'.join(map(PSQLClient._format_value, row))
+            for row in cursor.fetchall()
+        )
+
+    @staticmethod
+    def _format_value(value) -> str:
+        """Render a single value as psql text (NULL is empty, booleans t/f, arrays {a,b})."""
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        if isinstance(value, list):
+            return '{%s}' % ','.join(map(PSQLClient._format_value, value))
+        return str(value)
+
+    def close(self) -> None:
+        """Close the connection if one was opened, or return it to the pool."""
+        if self._conn is not None and self._pool is not None:
+            if not self._conn.closed:
+                self._conn.autocommit = False
+            self._pool.putconn(self._conn)
+        elif self._conn is not None and not self._conn.closed:
+            self._conn.close()
+        self._conn = None
+
+    def fetch_all(self, query: str, params: Optional[tuple] = None) -> list:
+        """
+        Execute a SQL query and return the rows as a list of tuples.
 
         Args:
-            query: SQL query to execute
-            input_data: Optional data to pipe to stdin
-            tuples_only: If True, returns tuples only without headers (-t flag)
-            unaligned: If True, returns unaligned output (-A flag)
+            query: SQL query to execute, using %s placeholders for params
+            params: Optional query parameters
 
         Returns:
-            Query output as a string
+            List of row tuples, empty if the query returns no rows
 
         Raises:
-            Exception: If the psql command fails
+            psycopg2.Error: If the query fails
         """
-        cmd = self._build_base_command()
-
-        if tuples_only:
-            cmd.append('-t')
-        if unaligned:
-            cmd.append('-A')
+        with self._get_connection().cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall() if cur.description is not None else []
 
-        cmd.extend(['-c', query])
+    def execute_query(self, query: str, params: Optional[tuple] = None) -> str:
+        """
+        Execute a SQL query and return the output as text.
 
-        result = subprocess.run(
-            cmd,
-            input=input_data,
-            capture_output=True,
-            text=True,
-            env=self._get_env_with_password()
-        )
+        Args:
+            query: SQL query to execute, using %s placeholders for params
+            params: Optional query parameters
 
-        if result.returncode != 0:
-            raise Exception(f"psql command failed: {result.stderr}")
+        Returns:
+            Query output as a string, formatted like psql's tuples-only unaligned output
 
-        return result.stdout.strip()
+        Raises:
+            psycopg2.Error: If the query fails
+        """
+        with self._get_connection().cursor() as cur:
+            cur.execute(query, params)
+            return self._format_rows(cur).strip()
 
     def copy_from_stdin(
         self,
@@ -121,7 +179,7 @@ class PSQLClient:
         columns: Optional[tuple] = None
     ) -> None:
         """
-        Insert data using COPY command via psql with data from stdin.
+        Insert data using COPY FROM STDIN over the open connection.
 
         Args:
             table_name: Name of the table to insert into
@@ -129,7 +187,7 @@ class PSQLClient:
             columns: Optional tuple of column names. If None, uses all columns.
 
         Raises:
-            Exception: If the COPY command fails
+            psycopg2.Error: If the COPY command fails
         """
         if columns:
             columns_str = f"({', '.join(columns)})"
@@ -138,19 +196,8 @@ class PSQLClient:
 
         copy_query = f'COPY {table_name} {columns_str} FROM STDIN'
 
-        cmd = self._build_base_command()
-        cmd.extend(['-c', copy_query])
-
-        result = subprocess.run(
-            cmd,
-            input=data,
-            capture_output=True,
-            text=True,
-            env=self._get_env_with_password()
-        )
-
-        if result.returncode != 0:
-            raise Exception(f"COPY command failed: {result.stderr}")
+        with self._get_connection().cursor() as cur:
+            cur.copy_expert(copy_query, StringIO(data))
 
     def execute_file(self, file_path: str) -> str:
         """
@@ -160,44 +207,45 @@ class PSQLClient:
             file_path: Path to SQL file
 
         Returns:
-            Output from executing the file
+            Status message of the last command in the file
 
         Raises:
-            Exception: If the psql command fails
+            psycopg2.Error: If any command in the file fails
         """
-        cmd = self._build_base_command()
-        cmd.extend(['-f', file_path])
-
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            env=self._get_env_with_password()
-        )
+        with open(file_path, 'r', encoding='utf-8') as f:
+            script = f.read()
 
-        if result.returncode != 0:
-            raise Exception(f"psql command failed: {result.stderr}")
-
-        return result.stdout.strip()
+        with self._get_connection().cursor() as cur:
+            cur.execute(script)
+            return (cur.statusmessage or '').strip()
 
     def execute_multiple_queries(self, queries: list) -> list:
         """
-        Execute multiple SQL queries sequentially.
+        Execute multiple SQL queries sequentially inside one transaction.
         """
+        conn = self._get_connection()
         results = []
-        for query in queries:
-            results.append(self.execute_query(query))
+
+        conn.autocommit = False
+        try:
+            # The connection context commits on success and rolls back on error
+            with conn, conn.cursor() as cur:
+                for query in queries:
+                    cur.execute(query)
+                    results.append(self._format_rows(cur).strip())
+        finally:
+            conn.autocommit = True
+
         return results
 
     def table_exists(self, table_name: str) -> bool:
         """
         Check if a table exists in the database.
         """
-        query = f"""
+        query = """
         SELECT EXISTS (
             SELECT FROM information_schema.tables
-            WHERE table_name = '{table_name}'
+            WHERE table_name = %s
         );
         """
-        result = self.execute_query(query)
-        return result.lower() == 't'
+        return bool(self.fetch_all(query, (table_name,))[0][0])
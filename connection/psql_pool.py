@@ -0,0 +1,76 @@
+"""
+Shared PostgreSQL connection pool.
+
+Scripts that talk to PostgreSQL from more than one thread check connections
+out of this process-wide pool instead of opening their own. The pool keeps
+up to minconn idle connections open between checkouts, so as long as a script
+never holds more than that at once, the handshake is only paid once per
+connection. Connections past minconn are closed as soon as they are returned.
+
+Connection parameters are read from the same environment variables as
+PSQLClient, so load the .env file before the first call to get_pool().
+
+@author Gustavo Bravo
+"""
+import os
+from contextlib import contextmanager
+from threading import Lock
+from typing import Iterator, Optional
+
+from psycopg2.extensions import connection
+from psycopg2.pool import ThreadedConnectionPool
+
+# Sized for the workload rather than the host. By default one connection is kept
+# (the one-table loader never needs more), scripts that run more at once pass their
+# own minconn to get_pool(). The cap is the most any loader uses at once: one COPY
+# per factor table in pq_multi_table_insert.py.
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 12
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = Lock()
+
+
+def get_pool(minconn: int = MIN_CONNECTIONS) -> ThreadedConnectionPool:
+    """
+    Return the shared pool, creating it on first use.
+    minconn is the number of connections the pool opens and keeps, set it to the
+    script's concurrency so returned connections aren't closed and reopened.
+    It only applies when the pool is created.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = ThreadedConnectionPool(
+                min(minconn, MAX_CONNECTIONS),
+                MAX_CONNECTIONS,
+                host=os.getenv('HOST'),
+                dbname=os.getenv('DATABASE'),
+                user=os.getenv('PQ_USER'),
+                password=os.getenv('PQ_USER_PASSWORD') or None,
+                port=os.getenv('PQ_PORT')
+            )
+        return _pool
+
+
+@contextmanager
+def pooled_connection() -> Iterator[connection]:
+    """
+    Check a connection out of the shared pool and always hand it back.
+    Any transaction left open is rolled back by the pool on return.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def close_pool() -> None:
+    """Close every connection held by the shared pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
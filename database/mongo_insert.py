@@ -14,16 +14,135 @@ This file will
 import urllib.parse
 import os
 
+from queue import Queue
+from threading import Event, Lock, Thread
 from dotenv import load_dotenv
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 from bson import Decimal128
-from decimal import Decimal
 
 
 load_dotenv(override=True)
 
 FILENAME = os.getenv('FILE_LOCATION', '')
-CHECKPOINT = 10000
+BATCH_SIZE = 10000  # Documents per insert_many round-trip
+MAX_WORKERS = 8     # Consumer threads, each running its own insert_many calls
+MAX_IN_FLIGHT = 16  # Batches queued in memory before the parser waits
+CHECKPOINT_FILE = FILENAME + '.mongo.ckpt'  # Last number of the highest contiguous committed batch
+DUPLICATE_KEY = 11000   # Server error code for an _id that is already in the collection
+
+
+def read_checkpoint() -> int:
+    """Return the last number saved by the checkpoint, or 0 if there isn't one."""
+    try:
+        with open(CHECKPOINT_FILE, 'r', encoding='utf-8') as ckpt:
+            return int(ckpt.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def remove_checkpoint() -> None:
+    """Delete the checkpoint, if there is one."""
+    try:
+        os.remove(CHECKPOINT_FILE)
+    except FileNotFoundError:
+        pass
+
+
+def write_checkpoint(last_number: int) -> None:
+    """Save the last number of the committed batches, replacing the old one atomically."""
+    tmp_file = CHECKPOINT_FILE + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as ckpt:
+        ckpt.write(str(last_number))
+    os.replace(tmp_file, CHECKPOINT_FILE)
+
+
+class BatchCheckpoint:
+    """
+    Tracks which batches have committed and checkpoints the last number of the
+    highest batch that every batch before it has also committed.
+
+    The consumers finish batches out of order, so a later batch committing
+    must not move the checkpoint past an earlier one that is still in flight
+    or that failed. A resumed load restarts right after the checkpoint.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._next_batch = 0
+        self._finished = {}
+
+    def done(self, batch_num: int, last_number: int) -> None:
+        """Record a committed batch and advance the checkpoint over any contiguous run."""
+        with self._lock:
+            self._finished[batch_num] = last_number
+            checkpoint = None
+            while self._next_batch in self._finished:
+                checkpoint = self._finished.pop(self._next_batch)
+                self._next_batch += 1
+            if checkpoint is not None:
+                write_checkpoint(checkpoint)
+
+
+def insert_batch(collection, batch: list) -> int:
+    """
+    Insert a batch of documents in a single round-trip.
+    The rows are already typed while parsing, so the validator is skipped.
+
+    A resumed load can resend rows that committed after the checkpoint, those
+    are rejected as duplicate _ids while the rest of the batch still goes in.
+    Returns the number of documents inserted.
+    """
+    try:
+        collection.insert_many(batch, ordered=False, bypass_document_validation=True)
+        return len(batch)
+    except BulkWriteError as e:
+        details = e.details
+        if details.get('writeConcernErrors') or any(
+            error['code'] != DUPLICATE_KEY for error in details['writeErrors']
+        ):
+            raise
+        return details['nInserted']
+
+
+def drop_factors_index(collection) -> None:
+    """
+    Drop the factors index a previous run built, so the inserts don't maintain it
+    row by row. Only called once there is a batch to insert.
+    """
+    if "factors_1" in collection.index_information():
+        collection.drop_index("factors_1")
+
+
+def insert_worker(
+        collection,
+        batches: Queue,
+        checkpoint: BatchCheckpoint,
+        inserted: list,
+        errors: list,
+        failed: Event
+    ) -> None:
+    """
+    Consumer thread: insert batches from the queue until the None sentinel arrives.
+    The first failure is recorded and flags the load as failed. After that the
+    remaining batches are drained without being inserted, so the parser never
+    blocks on the queue and stops as soon as it sees the flag.
+    """
+    while True:
+        item = batches.get()
+        if item is None:
+            return
+        if failed.is_set():
+            continue
+
+        batch_num, last_number, batch = item
+        try:
+            inserted.append(insert_batch(collection, batch))
+            checkpoint.done(batch_num, last_number)
+        except Exception as e:
+            errors.append(e)
+            failed.set()
+
 
 def insert_data():
     user = urllib.parse.quote_plus(os.getenv('MONGO_USER', ''))
@@ -36,58 +155,141 @@ def insert_data():
     db_name = os.getenv('DATABASE', '')
     if not db_name:
         raise ValueError("Provide a non-empty db name.")
-    
+
     row_count = 0
     batch = []
+    batch_num = 0
+    queued = 0
+
+    # The main thread parses the file (producer) while the workers insert (consumers)
+    # The bounded queue keeps the parser from running too far ahead of the server
+    batches = Queue(maxsize=MAX_IN_FLIGHT)
+    checkpoint = BatchCheckpoint()
+    inserted = []
+    errors = []
+    failed = Event()
 
     # Context manager handles closing if failure
-    with MongoClient(uri) as client:
+    # Unordered batches are sent concurrently, one pooled connection per consumer
+    # Writes are acknowledged by the primary without waiting on the journal, and the
+    # wire traffic is compressed (zstd when the zstandard module is installed, else zlib)
+    # Retryable writes stay on (the default): an insert_many keyed on _id is safe to
+    # resend, and a transient network error shouldn't fail the whole load
+    with MongoClient(
+            uri,
+            maxPoolSize=50,
+            maxConnecting=MAX_WORKERS,
+            w=1,
+            journal=False,
+            compressors="zstd,zlib"
+         ) as client:
         db = client[db_name]
 
         if "carmichael_number" not in db.list_collection_names():
             # Enforce a schema for our new collection
             cn_collection = db.create_collection(
-                "carmichael_number", 
+                "carmichael_number",
                 validator={
                         "_id": {"$type": "decimal"},
                         "factors": {"$type": "array"}
                 },
                 validationLevel="strict"
             )
+            # A checkpoint left from before the collection was dropped belongs to the old data
+            remove_checkpoint()
             max_inserted = 0
         else: # Look for checkpoint
             cn_collection = db["carmichael_number"]
-            max_query = cn_collection.aggregate([
-                {
-                    "$group": {
-                        "_id": None,
-                        "max_carmichael": {"$max": "$_id"}
-                    }
-                }
-            ]).next()
-            max_inserted = Decimal(str(max_query['max_carmichael']))
-
-        with open(FILENAME, encoding='utf-8') as file:
-            for line in file:
-                parts = line.strip().split(' ')
-
-                if max_inserted >= Decimal(parts[0].strip()):
-                    continue
-
-                batch.append({
-                    "_id": Decimal128(parts[0].strip()),
-                    "factors": [int(factor.strip()) for factor in parts[1:]]
-                })
-
-                if len(batch) == CHECKPOINT:
-                    cn_collection.insert_many(batch, ordered=False)
-                    row_count += len(batch)
-                    batch = []
-                    print(f"Inserted {row_count} rows.")
-        
+            # Batches commit out of order, so the largest _id in the collection can sit
+            # past a batch that never made it in. The checkpoint only covers batches
+            # that committed along with every batch before them.
+            # Without one the whole file is resent and existing rows are skipped as duplicates.
+            max_inserted = read_checkpoint()
+            last_doc = cn_collection.find_one(sort=[("_id", -1)], projection={"_id": 1})
+            max_id = int(last_doc["_id"].to_decimal()) if last_doc else 0
+
+            if max_inserted > max_id:
+                # Writes aren't journaled, so a crash can lose batches the checkpoint already covers
+                print(f"Checkpoint {max_inserted} is past the collection ({max_id}), ignoring it")
+                max_inserted = 0
+            elif not max_inserted and "factors_1" in cn_collection.index_information():
+                # A finished load removes its checkpoint and leaves the factors index behind,
+                # every row up to the largest _id is already in
+                max_inserted = max_id
+            print(f"Resuming after {max_inserted}")
+
+        workers = [
+            Thread(
+                target=insert_worker,
+                args=(cn_collection, batches, checkpoint, inserted, errors, failed)
+            )
+            for _ in range(MAX_WORKERS)
+        ]
+        for worker in workers:
+            worker.start()
+
+        # The consumers are always stopped and joined, even if parsing fails part way,
+        # otherwise the process would wait on them forever
+        try:
+            with open(FILENAME, encoding='utf-8') as file:
+                for line in file:
+                    # Only the number is split off until the row is known to be new
+                    cm_number, _, factors = line.rstrip().partition(' ')
+                    if not cm_number:
+                        continue
+
+                    number = int(cm_number)
+                    if max_inserted >= number:
+                        continue
+
+                    # map dispatches int() from C and the rstrip already dropped the whitespace
+                    batch.append({
+                        "_id": Decimal128(cm_number),
+                        "factors": list(map(int, factors.split(' '))) if factors else []
+                    })
+
+                    if len(batch) >= BATCH_SIZE:
+                        # Stop reading as soon as a batch has failed
+                        if failed.is_set():
+                            break
+                        # A rerun with nothing new keeps the index it already has
+                        if batch_num == 0:
+                            drop_factors_index(cn_collection)
+                        batches.put((batch_num, number, batch))
+                        batch_num += 1
+                        queued += len(batch)
+                        batch = []
+                        print(f"Queued {queued} rows.")
+
+            # Flush whatever is left over from the last partial batch
+            if batch and not failed.is_set():
+                if batch_num == 0:
+                    drop_factors_index(cn_collection)
+                batches.put((batch_num, number, batch))
+        except BaseException:
+            # Have the consumers drop what is still queued instead of inserting it
+            failed.set()
+            raise
+        finally:
+            # One sentinel per consumer, then wait for all of them to finish
+            for _ in workers:
+                batches.put(None)
+            for worker in workers:
+                worker.join()
+
+        if errors:
+            raise errors[0]
+
+        row_count = sum(inserted)
+        print(f"Inserted {row_count} rows.")
+
         # Create an index on factors in ascending order (default)
+        # Built once over the loaded collection rather than maintained during the inserts
         cn_collection.create_index("factors")
 
+        # The load is complete, a rerun resumes after the largest _id instead
+        remove_checkpoint()
+
 
 if __name__ == "__main__":
-    insert_data()
\ No newline at end of file
+    insert_data()
@@ -1,97 +1,126 @@
-import subprocess
-from decimal import Decimal
-from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import sys
 import os
 from dotenv import load_dotenv
 
+sys.path.append(str(os.path.join(os.path.dirname(__file__), '..')))
+from connection.psql_pool import MAX_CONNECTIONS, close_pool, get_pool, pooled_connection
+
 # Load environment variables
 load_dotenv(override=True)
 
 # Constants
 FILENAME = os.getenv('FILE_LOCATION', '')   # Must be in your .env file
 BATCH_SIZE = 1000000                        # Commit every 1 million rows
+CHECKPOINT_FILE = FILENAME + '.multi_table.ckpt'  # Byte offset after the last committed batch and each table's last number
+READ_CHUNK_SIZE = 1 << 24                   # Read the input file 16MB at a time
+COPY_WORKERS = min(12, MAX_CONNECTIONS)     # One COPY per factor table, bounded by the pool
 
-def run_psql_query(query, input_data=None):
-    """
-    Execute a SQL query using psql command-line tool.
-    Returns the output as a string.
-    """
-    # Build connection string
-    host = os.getenv('HOST')
-    database = os.getenv('DATABASE')
-    user = os.getenv('PQ_USER')
-    password = os.getenv('PQ_USER_PASSWORD', '')
-    port = os.getenv('PQ_PORT')
-
-    # Build psql command
-    cmd = [
-        'psql',
-        '-h', host,
-        '-U', user,
-        '-d', database,
-        '-p', port,
-        '-t',  # Tuples only (no headers)
-        '-A',  # Unaligned output
-        '-c', query
-    ]
-
-    # Set password as environment variable
-    env = os.environ.copy()
-    if password:
-        env['PGPASSWORD'] = password
-
-    # Run the command
-    result = subprocess.run(
-        cmd,
-        input=input_data,
-        capture_output=True,
-        text=True,
-        env=env
-    )
+# One buffer per factor table, reused by every batch. They keep the size of the
+# largest batch seen, so later batches overwrite in place instead of reallocating.
+_copy_buffers = {i: bytearray() for i in range(3, 15)}
 
-    if result.returncode != 0:
-        raise Exception(f"psql command failed: {result.stderr}")
-
-    return result.stdout.strip()
-
-def insert_batch(table_name, data):
-    """
-    Insert batch data using COPY command via psql.
-    Data should be tab-separated values ready for COPY FROM STDIN.
-    """
-    # Build connection parameters
-    host = os.getenv('HOST')
-    database = os.getenv('DATABASE')
-    user = os.getenv('PQ_USER')
-    password = os.getenv('PQ_USER_PASSWORD', '')
-    port = os.getenv('PQ_PORT')
-
-    # Build psql command for COPY
-    cmd = [
-        'psql',
-        '-h', host,
-        '-U', user,
-        '-d', database,
-        '-p', port,
-        '-c', f'COPY {table_name} (number, factors) FROM STDIN'
-    ]
-
-    # Set password as environment variable
-    env = os.environ.copy()
-    if password:
-        env['PGPASSWORD'] = password
-
-    # Run the command with data piped to stdin
-    result = subprocess.run(
-        cmd,
-        input=data,
-        capture_output=True,
-        text=True,
-        env=env
-    )
+def run_psql_query(query):
+    """
+    Execute a SQL query on a pooled connection.
+    Returns the fetched rows as a list of tuples.
+    """
+    with pooled_connection() as conn:
+        with conn, conn.cursor() as cur:
+            cur.execute(query)
+            return cur.fetchall()
 
-    if result.returncode != 0:
-        raise Exception(f"COPY command failed: {result.stderr}")
+def run_psql_command(command):
+    """
+    Execute a SQL command that returns no rows on a pooled connection.
+    Runs in autocommit mode so commands that refuse transactions (VACUUM) work too.
+    """
+    with pooled_connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute(command)
+        finally:
+            conn.autocommit = False
+
+def insert_batch(table_name, buffer):
+    """
+    Insert batch data using COPY on a pooled connection.
+    Buffer should hold tab-separated values ready for COPY FROM STDIN.
+    The transaction commits when the with block exits, without waiting on the WAL flush.
+    """
+    with pooled_connection() as conn:
+        with conn, conn.cursor() as cur:
+            cur.execute('SET LOCAL synchronous_commit = off')
+            cur.copy_expert(f'COPY {table_name} (number, factors) FROM STDIN', buffer)
+
+def prepare_bulk_load():
+    """
+    Pause autovacuum on every factor table while loading.
+    The tables only carry their primary key, so there are no indexes to drop.
+    """
+    for num_factors in range(3, 15):
+        run_psql_command(f"ALTER TABLE carmichael_number_{num_factors} SET (autovacuum_enabled = false)")
+
+def bulk_load_pending():
+    """
+    Return True if a previous load stopped before finishing,
+    leaving autovacuum paused on any factor table.
+    """
+    tables = ", ".join(f"'carmichael_number_{num_factors}'::regclass" for num_factors in range(3, 15))
+    return run_psql_query(f"""
+        SELECT COALESCE(bool_or('autovacuum_enabled=false' = ANY(reloptions)), false)
+        FROM pg_class
+        WHERE oid IN ({tables})
+    """)[0][0]
+
+def finish_bulk_load():
+    """
+    Turn autovacuum back on for every factor table and refresh the planner statistics.
+    """
+    for num_factors in range(3, 15):
+        table_name = f"carmichael_number_{num_factors}"
+        run_psql_command(f"ALTER TABLE {table_name} SET (autovacuum_enabled = true)")
+        run_psql_command(f"VACUUM ANALYZE {table_name}")
+
+def read_checkpoint():
+    """
+    Return the file offset saved after the last committed batch and the largest
+    number each table held before it, or (0, {}) if there isn't a checkpoint.
+    """
+    try:
+        with open(CHECKPOINT_FILE, 'r', encoding='utf-8') as ckpt:
+            fields = ckpt.read().split()
+    except FileNotFoundError:
+        return 0, {}
+    # A checkpoint without its numbers can't be checked against the tables
+    if len(fields) != 13:
+        return 0, {}
+    return int(fields[0]), dict(zip(range(3, 15), map(int, fields[1:])))
+
+def write_checkpoint(offset, last_numbers):
+    """Save the offset of the first row not yet inserted and each table's number just before it, atomically."""
+    tmp_file = CHECKPOINT_FILE + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as ckpt:
+        ckpt.write(" ".join(map(str, [offset] + [last_numbers[i] for i in range(3, 15)])))
+    os.replace(tmp_file, CHECKPOINT_FILE)
+
+def read_lines(file_handle):
+    """
+    Yield the lines of a binary file without their newline. The file is read
+    in large chunks so lines are split in C rather than one readline at a time.
+    """
+    leftover = b''
+    while True:
+        chunk = file_handle.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        lines = (leftover + chunk).split(b'\n')
+        leftover = lines.pop()
+        yield from lines
+    if leftover:
+        yield leftover
 
 def main():
     """
@@ -106,107 +135,188 @@ def main():
             ("the carmichael numbers in the correct format.")
         )
 
-    # Get the max value from all tables and keep the largest
-    last_inserted = 0
-    for num_factors in range(3, 15):
-        table_name = f"carmichael_number_{num_factors}"
-        max_result = run_psql_query(f"SELECT MAX(number) FROM {table_name}")
-        max_val = Decimal(max_result) if max_result and max_result != '' else 0
-        if max_val > last_inserted:
-            last_inserted = max_val
+    # Keep a connection open for every concurrent COPY, so each batch reuses them
+    get_pool(minconn=COPY_WORKERS)
 
-    processing = last_inserted != 0
+    # Get the max value of every table in one round trip
+    # Empty tables return null, which counts as 0
+    # The tables of a batch commit independently, so a failed batch can leave some of
+    # them ahead of the others. Each row is only skipped against the max of its own table.
+    max_query = " UNION ALL ".join(
+        f"SELECT {num_factors} AS tbl, MAX(number) FROM carmichael_number_{num_factors}"
+        for num_factors in range(3, 15)
+    )
+    last_inserted = {num_factors: max_result or 0 for num_factors, max_result in run_psql_query(max_query)}
+
+    processing = any(last_inserted.values())
 
     batch_num = 0
     total_inserted = {i: 0 for i in range(3, 15)}  # Track inserts per table
 
-    print(f"Beginning at carmichael numbers greater than {last_inserted}")
     if processing:
-        print("Skipping...")
-
-    # Skips rows already inserted inside get_batch (linearly)
-    # File marker (f) maintains our spot after each batch
-    with open(FILENAME, 'r', encoding='utf-8') as f:
-        while True:
-            batch_num += 1
-
-            print(f"\nBatch {batch_num}: Reading up to {BATCH_SIZE} rows...")
-
-            # Get batch data as dictionary of StringIO buffers (one per table)
-            buffers, batch_counts = get_batch(f, last_inserted, processing)
-
-            # If no rows were read, we're done
-            if sum(batch_counts.values()) == 0:
-                print(f"\nImport complete!")
-                break
-
-            # Insert batches for each table using subprocess
-            for num_factors in range(3, 15):
-                if batch_counts[num_factors] > 0:
-                    table_name = f"carmichael_number_{num_factors}"
-                    insert_batch(table_name, buffers[num_factors].getvalue())
+        print("Skipping carmichael numbers already in their table:")
+        for num_factors, max_result in last_inserted.items():
+            if max_result:
+                print(f"  - carmichael_number_{num_factors}: up to {max_result}")
+
+    # The bulk load is only prepared once a batch has rows, so a rerun with nothing
+    # new doesn't vacuum every table again. It is only finished once every batch
+    # is in. If it stops part way the restore is skipped, so a partial table doesn't
+    # pay for it and a broken connection can't replace the original error with one
+    # from the restore. A later run finishes it, even one with no rows left to load.
+    pending = bulk_load_pending()
+    loading = False
+    try:
+        # Seeks past the rows committed by a previous run using the checkpoint offset
+        # Rows committed after the last checkpoint write are still skipped inside get_batch (linearly)
+        # The line reader (lines) maintains our spot after each batch, offset tracks it in bytes
+        with open(FILENAME, 'rb') as f, \
+             ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+            offset, checkpoint_numbers = read_checkpoint() if processing else (0, {})
+            # Batches commit without waiting on the WAL flush, so a server crash can lose
+            # batches whose checkpoint was already written. Only seek if every table still
+            # holds its last number before the offset, otherwise skip linearly from the start.
+            behind = [
+                num_factors for num_factors, number in checkpoint_numbers.items()
+                if number > last_inserted[num_factors]
+            ]
+            if offset and behind:
+                print(f"Checkpoint is past carmichael_number_{behind[0]}, ignoring it")
+                offset = 0
+            if offset:
+                print(f"Resuming from checkpoint at byte {offset}")
+                f.seek(offset)
+
+            # Largest number each table holds before offset, saved along with it
+            # Starting from the table maxes covers the rows skipped before the first new one
+            last_numbers = dict(last_inserted)
+
+            lines = read_lines(f)
+            while True:
+                batch_num += 1
+
+                print(f"\nBatch {batch_num}: Reading up to {BATCH_SIZE} rows...")
+
+                # Get batch data as dictionary of BytesIO buffers (one per table)
+                buffers, batch_counts, consumed, batch_last = get_batch(lines, last_inserted, processing)
+
+                # If no rows were read, we're done
+                if sum(batch_counts.values()) == 0:
+                    print(f"\nImport complete!")
+                    break
+
+                if not loading:
+                    prepare_bulk_load()
+                    loading = True
+
+                # Insert batches for each table concurrently, each on its own pooled connection
+                # The batch now takes as long as the slowest table instead of the sum of all of them
+                futures = {
+                    num_factors: executor.submit(
+                        insert_batch, f"carmichael_number_{num_factors}", buffers[num_factors]
+                    )
+                    for num_factors in range(3, 15)
+                    if batch_counts[num_factors] > 0
+                }
+                for num_factors, future in futures.items():
+                    future.result()
                     total_inserted[num_factors] += batch_counts[num_factors]
-
-            # Print batch summary
-            batch_total = sum(batch_counts.values())
-            print(f"Batch {batch_num} complete: {batch_total} rows")
-            for num_factors in range(3, 15):
-                if batch_counts[num_factors] > 0:
-                    print(f"  - {num_factors} factors: {batch_counts[num_factors]} rows (Total: {total_inserted[num_factors]})")
-
-            # If we got fewer rows than batch size, we're done
-            if batch_total < BATCH_SIZE:
-                print(f"\nImport complete!")
-                print("Final totals:")
+                offset += consumed
+                for num_factors, number in batch_last.items():
+                    last_numbers[num_factors] = int(number)
+                write_checkpoint(offset, last_numbers)
+
+                # Print batch summary
+                batch_total = sum(batch_counts.values())
+                print(f"Batch {batch_num} complete: {batch_total} rows")
                 for num_factors in range(3, 15):
-                    if total_inserted[num_factors] > 0:
-                        print(f"  - carmichael_number_{num_factors}: {total_inserted[num_factors]} rows")
-                break
-
-
-def get_batch(file_handle, last_inserted, processing):
-    """Read a batch of rows and return as dictionary of StringIO buffers"""
-    buffers = {i: StringIO() for i in range(3, 15)}
+                    if batch_counts[num_factors] > 0:
+                        print(f"  - {num_factors} factors: {batch_counts[num_factors]} rows (Total: {total_inserted[num_factors]})")
+
+                # If we got fewer rows than batch size, we're done
+                if batch_total < BATCH_SIZE:
+                    print(f"\nImport complete!")
+                    print("Final totals:")
+                    for num_factors in range(3, 15):
+                        if total_inserted[num_factors] > 0:
+                            print(f"  - carmichael_number_{num_factors}: {total_inserted[num_factors]} rows")
+                    break
+    except BaseException:
+        if loading or pending:
+            print(f"\nLoad stopped part way, autovacuum stays off until a rerun completes it.")
+        raise
+    else:
+        if loading or pending:
+            finish_bulk_load()
+
+
+def get_batch(lines, last_inserted, processing):
+    """
+    Read a batch of rows and return as dictionary of BytesIO buffers, along with the
+    per-table counts, the number of file bytes consumed and each table's last number.
+    Rows are written into the shared _copy_buffers from the start on every call.
+    While processing, a row is skipped if its table already holds a number at least as large.
+    """
+    positions = {i: 0 for i in range(3, 15)}
     batch_counts = {i: 0 for i in range(3, 15)}
     total_batch_count = 0
-
-    for line in file_handle:
-        parts = line.strip().split()
-        if not parts:
+    # Numbers are canonical digit strings, so (length, digits) orders them like the integers
+    last_keys = {}
+    for num_factors, max_result in last_inserted.items():
+        last_str = str(int(max_result)).encode()
+        last_keys[num_factors] = (len(last_str), last_str)
+    max_key = max(last_keys.values())
+    consumed = 0
+    last_numbers = {}
+
+    for line in lines:
+        consumed += len(line) + 1
+        # Rows are "number factor factor ...", separated by single spaces
+        cm_number, _, factors = line.rstrip().partition(b' ')
+        if not cm_number:
             continue
 
-        cm_number = parts[0].strip()
-
-        # Skip already processed
-        if processing:
-            if Decimal(cm_number) <= Decimal(last_inserted):
-                continue
-            else:
-                processing = False
-
-        factors = parts[1:]
-        num_factors = len(factors)
+        num_factors = factors.count(b' ') + 1 if factors else 0
 
         # Only process if number of factors is between 3 and 14 (inclusive)
         if not (3 <= num_factors <= 14):
             continue
 
-        factors_psql = '{' + ','.join(factors) + '}'
+        # Skip already processed, against the table the row goes to
+        # Past the largest max of every table nothing is left to skip
+        if processing:
+            key = (len(cm_number), cm_number)
+            if key > max_key:
+                processing = False
+            elif key <= last_keys[num_factors]:
+                continue
 
         # Write to appropriate buffer based on number of factors
-        buffers[num_factors].write(f"{cm_number}\t{factors_psql}\n")
+        # The array literal is the factor list with its spaces swapped for commas
+        # One join builds the row without the intermediate bytes each + would allocate
+        # Slice assignment overwrites in place, and only grows the buffer past its end
+        row = b''.join((cm_number, b'\t{', factors.replace(b' ', b','), b'}\n'))
+        pos = positions[num_factors]
+        _copy_buffers[num_factors][pos:pos + len(row)] = row
+        positions[num_factors] = pos + len(row)
         batch_counts[num_factors] += 1
+        last_numbers[num_factors] = cm_number
         total_batch_count += 1
 
         # Stop after batch size
         if total_batch_count >= BATCH_SIZE:
             break
 
-    # Reset IO pointers for all buffers
-    for buffer in buffers.values():
-        buffer.seek(0)
+    # Hand COPY a copy of just the used region, so the shared buffers can be refilled
+    buffers = {}
+    for num_factors, buffer in _copy_buffers.items():
+        with memoryview(buffer) as view:
+            buffers[num_factors] = BytesIO(view[:positions[num_factors]])
 
-    return buffers, batch_counts
+    return buffers, batch_counts, consumed, last_numbers
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        close_pool()
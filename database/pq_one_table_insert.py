@@ -1,97 +1,136 @@
-import subprocess
-from decimal import Decimal
-from io import StringIO
+from io import BytesIO
+import struct
+import sys
 import os
 from dotenv import load_dotenv
 
+sys.path.append(str(os.path.join(os.path.dirname(__file__), '..')))
+from connection.psql_pool import close_pool, pooled_connection
+
 # Load environment variables
 load_dotenv(override=True)
 
 # Constants
 FILENAME = os.getenv('FILE_LOCATION', '')   # Must be in your .env file
 BATCH_SIZE = 1000000                        # Commit every 1 million rows
+CHECKPOINT_FILE = FILENAME + '.one_table.ckpt'  # Byte offset after the last committed batch and its last number
+READ_CHUNK_SIZE = 1 << 24                   # Read the input file 16MB at a time
 
-def run_psql_query(query, input_data=None):
-    """
-    Execute a SQL query using psql command-line tool.
-    Returns the output as a string.
-    """
-    # Build connection string
-    host = os.getenv('HOST')
-    database = os.getenv('DATABASE')
-    user = os.getenv('PQ_USER')
-    password = os.getenv('PQ_USER_PASSWORD', '')
-    port = os.getenv('PQ_PORT')
-
-    # Build psql command
-    cmd = [
-        'psql',
-        '-h', host,
-        '-U', user,
-        '-d', database,
-        '-p', port,
-        '-t',  # Tuples only (no headers)
-        '-A',  # Unaligned output
-        '-c', query
-    ]
-
-    # Set password as environment variable
-    env = os.environ.copy()
-    if password:
-        env['PGPASSWORD'] = password
-
-    # Run the command
-    result = subprocess.run(
-        cmd,
-        input=input_data,
-        capture_output=True,
-        text=True,
-        env=env
-    )
+# Binary COPY framing: signature, flags and header extension length, then -1 to end the stream
+COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+COPY_TRAILER = struct.pack('!h', -1)
+INT8_OID = 20                               # Element type of BIGINT[]
+COPY_BUFFER_SIZE = 256 << 20                # Starting size of the reusable COPY buffer (256MB)
 
-    if result.returncode != 0:
-        raise Exception(f"psql command failed: {result.stderr}")
-
-    return result.stdout.strip()
-
-def insert_batch(data):
-    """
-    Insert batch data using COPY command via psql.
-    Data should be tab-separated values ready for COPY FROM STDIN.
-    """
-    # Build connection parameters
-    host = os.getenv('HOST')
-    database = os.getenv('DATABASE')
-    user = os.getenv('PQ_USER')
-    password = os.getenv('PQ_USER_PASSWORD', '')
-    port = os.getenv('PQ_PORT')
-
-    # Build psql command for COPY
-    cmd = [
-        'psql',
-        '-h', host,
-        '-U', user,
-        '-d', database,
-        '-p', port,
-        '-c', 'COPY carmichael_number (number, factors) FROM STDIN'
-    ]
-
-    # Set password as environment variable
-    env = os.environ.copy()
-    if password:
-        env['PGPASSWORD'] = password
-
-    # Run the command with data piped to stdin
-    result = subprocess.run(
-        cmd,
-        input=data,
-        capture_output=True,
-        text=True,
-        env=env
-    )
+# Every batch is packed into this one buffer, which only ever grows, so a batch
+# doesn't allocate a bytes object per row. Row layouts are cached by shape.
+_copy_buffer = bytearray(COPY_BUFFER_SIZE)
+_row_structs = {}
+
+def run_psql_query(query):
+    """
+    Execute a SQL query on a pooled connection.
+    Returns the fetched rows as a list of tuples.
+    """
+    with pooled_connection() as conn:
+        with conn, conn.cursor() as cur:
+            cur.execute(query)
+            return cur.fetchall()
+
+def run_psql_command(command):
+    """
+    Execute a SQL command that returns no rows on a pooled connection.
+    Runs in autocommit mode so commands that refuse transactions (VACUUM) work too.
+    """
+    with pooled_connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute(command)
+        finally:
+            conn.autocommit = False
+
+def insert_batch(buffer):
+    """
+    Insert batch data using a binary COPY on a pooled connection.
+    Buffer should hold a complete binary COPY stream (see get_batch).
+    The transaction commits when the with block exits, without waiting on the WAL flush.
+    """
+    with pooled_connection() as conn:
+        with conn, conn.cursor() as cur:
+            cur.execute('SET LOCAL synchronous_commit = off')
+            cur.copy_expert(
+                'COPY carmichael_number (number, factors) FROM STDIN WITH (FORMAT BINARY)',
+                buffer
+            )
+
+def prepare_bulk_load():
+    """
+    Drop the GIN index and pause autovacuum while loading, so each batch
+    only has to maintain the primary key.
+    """
+    run_psql_command("DROP INDEX IF EXISTS factors_index")
+    run_psql_command("ALTER TABLE carmichael_number SET (autovacuum_enabled = false)")
+
+def bulk_load_pending():
+    """
+    Return True if a previous load stopped before finishing,
+    leaving factors_index dropped or autovacuum paused.
+    """
+    return run_psql_query("""
+        SELECT to_regclass('factors_index') IS NULL
+            OR COALESCE('autovacuum_enabled=false' = ANY(reloptions), false)
+        FROM pg_class
+        WHERE oid = 'carmichael_number'::regclass
+    """)[0][0]
+
+def finish_bulk_load():
+    """
+    Rebuild the GIN index in one pass over the loaded table, turn autovacuum
+    back on and refresh the planner statistics.
+    """
+    print("Rebuilding factors_index...")
+    run_psql_command("CREATE INDEX IF NOT EXISTS factors_index ON carmichael_number USING GIN (factors)")
+    run_psql_command("ALTER TABLE carmichael_number SET (autovacuum_enabled = true)")
+    run_psql_command("VACUUM ANALYZE carmichael_number")
+
+def read_checkpoint():
+    """
+    Return the file offset saved after the last committed batch and the last number
+    of that batch, or (0, 0) if there isn't a checkpoint.
+    """
+    try:
+        with open(CHECKPOINT_FILE, 'r', encoding='utf-8') as ckpt:
+            fields = ckpt.read().split()
+    except FileNotFoundError:
+        return 0, 0
+    # A checkpoint without its number can't be checked against the table
+    if len(fields) != 2:
+        return 0, 0
+    return int(fields[0]), int(fields[1])
 
-    if result.returncode != 0:
-        raise Exception(f"COPY command failed: {result.stderr}")
+def write_checkpoint(offset, last_number):
+    """Save the offset of the first row not yet inserted and the number just before it, atomically."""
+    tmp_file = CHECKPOINT_FILE + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as ckpt:
+        ckpt.write(f"{offset} {last_number}")
+    os.replace(tmp_file, CHECKPOINT_FILE)
+
+def read_lines(file_handle):
+    """
+    Yield the lines of a binary file without their newline. The file is read
+    in large chunks so lines are split in C rather than one readline at a time.
+    """
+    leftover = b''
+    while True:
+        chunk = file_handle.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        lines = (leftover + chunk).split(b'\n')
+        leftover = lines.pop()
+        yield from lines
+    if leftover:
+        yield leftover
 
 def main():
     """
@@ -106,10 +145,10 @@ def main():
         )
 
     # Get the max value from database
-    max_result = run_psql_query("SELECT MAX(number) FROM carmichael_number")
+    max_result = run_psql_query("SELECT MAX(number) FROM carmichael_number")[0][0]
 
-    # If query returns empty or null, set the value to 0 and skip the processing step
-    last_inserted = Decimal(max_result) if max_result and max_result != '' else 0
+    # If query returns null (empty table), set the value to 0 and skip the processing step
+    last_inserted = max_result if max_result is not None else 0
     processing = last_inserted != 0
 
     batch_num = 0
@@ -119,59 +158,149 @@ def main():
     if processing:
         print("Skipping...")
 
-    # Skips rows already inserted inside get_batch (linearly)
-    # File marker (f) maintains our spot after each batch
-    with open(FILENAME, 'r', encoding='utf-8') as f:
-        while True:
-            batch_num += 1
+    # The bulk load is only prepared once a batch has rows, so a rerun with nothing
+    # new doesn't drop and rebuild the index. It is only finished once every batch
+    # is in. If it stops part way the restore is skipped, so a partial table doesn't
+    # pay for it and a broken connection can't replace the original error with one
+    # from the restore. A later run finishes it, even one with no rows left to load.
+    pending = bulk_load_pending()
+    loading = False
+    try:
+        # Seeks past the rows committed by a previous run using the checkpoint offset
+        # Rows committed after the last checkpoint write are still skipped inside get_batch (linearly)
+        # The line reader (lines) maintains our spot after each batch, offset tracks it in bytes
+        with open(FILENAME, 'rb') as f:
+            offset, checkpoint_number = read_checkpoint() if processing else (0, 0)
+            # Batches commit without waiting on the WAL flush, so a server crash can lose
+            # batches whose checkpoint was already written. Only seek if the table still
+            # holds the last number before the offset, otherwise skip linearly from the start.
+            if offset and checkpoint_number > last_inserted:
+                print(f"Checkpoint is past the table ({checkpoint_number} > {last_inserted}), ignoring it")
+                offset = 0
+            if offset:
+                print(f"Resuming from checkpoint at byte {offset}")
+                f.seek(offset)
+
+            lines = read_lines(f)
+            while True:
+                batch_num += 1
+
+                print(f"\nBatch {batch_num}: Reading up to {BATCH_SIZE} rows...")
+
+                # Get batch data as a binary COPY buffer
+                buffer, batch_count, consumed, batch_last = get_batch(lines, last_inserted, processing)
+
+                # If no rows were read, we're done
+                if batch_count == 0:
+                    print(f"\nImport complete!")
+                    break
+
+                if not loading:
+                    prepare_bulk_load()
+                    loading = True
+
+                # Insert this batch using COPY on a pooled connection
+                insert_batch(buffer)
+                offset += consumed
+                write_checkpoint(offset, int(batch_last))
+
+                total_inserted += batch_count
+
+                print(f"Batch {batch_num} complete: {batch_count} rows (Total: {total_inserted})")
 
-            print(f"\nBatch {batch_num}: Reading up to {BATCH_SIZE} rows...")
+                # If we got fewer rows than batch size, we're done
+                if batch_count < (BATCH_SIZE):
+                    print(f"\nImport complete! Total inserted: {total_inserted}")
+                    break
+    except BaseException:
+        if loading or pending:
+            print(f"\nLoad stopped part way, factors_index and autovacuum stay off until a rerun completes it.")
+        raise
+    else:
+        if loading or pending:
+            finish_bulk_load()
 
-            # Get batch data as StringIO buffer
-            buffer, batch_count = get_batch(f, last_inserted, processing)
 
-            # If no rows were read, we're done
-            if batch_count == 0:
-                print(f"\nImport complete!")
-                break
+def encode_row(buffer, pos, cm_number, factors):
+    """
+    Encode one row in PostgreSQL's binary COPY format, so the server
+    doesn't have to parse the text of every number and array element.
+    The row is packed into buffer at pos (growing it if needed) and the
+    position just past it is returned.
+
+    The row is the field count, then each field as a length and its bytes:
+        - number: NUMERIC as base 10000 digit groups, most significant first.
+        - factors: one dimensional BIGINT[] with its header and 8 byte elements.
+    """
+    # Split the decimal digits into groups of four from the right
+    head = len(cm_number) % 4 or 4
+    groups = [int(cm_number[:head])]
+    groups += [int(cm_number[i:i + 4]) for i in range(head, len(cm_number), 4)]
+    weight = len(groups) - 1
 
-            # Insert this batch using COPY command via psql
-            insert_batch(buffer.getvalue())
+    # Trailing zero groups are implied by the weight
+    while groups and groups[-1] == 0:
+        groups.pop()
 
-            total_inserted += batch_count
+    num_groups = len(groups)
+    num_factors = len(factors)
 
-            print(f"Batch {batch_num} complete: {batch_count} rows (Total: {total_inserted})")
+    elements = []
+    for factor in factors:
+        elements += (8, int(factor))
 
-            # If we got fewer rows than batch size, we're done
-            if batch_count < (BATCH_SIZE):
-                print(f"\nImport complete! Total inserted: {total_inserted}")
-                break
+    row_struct = _row_structs.get((num_groups, num_factors))
+    if row_struct is None:
+        row_struct = struct.Struct(f'!h ihhhh{num_groups}h iiiiii{"iq" * num_factors}')
+        _row_structs[(num_groups, num_factors)] = row_struct
+
+    end = pos + row_struct.size
+    if end > len(buffer):
+        buffer.extend(bytes(max(end, len(buffer))))
+
+    row_struct.pack_into(
+        buffer, pos,
+        2,
+        8 + 2 * num_groups, num_groups, weight, 0, 0, *groups,
+        20 + 12 * num_factors, 1, 0, INT8_OID, num_factors, 1, *elements
+    )
+    return end
 
 
-def get_batch(file_handle, last_inserted, processing):
-    """Read a batch of rows and return as StringIO buffer"""
-    buffer = StringIO()
+def get_batch(lines, last_inserted, processing):
+    """
+    Read a batch of rows and return as a binary COPY buffer, along with the row count,
+    the number of file bytes consumed and the last number in the batch.
+    Rows are packed into the shared _copy_buffer from the start on every call.
+    """
+    buffer = _copy_buffer
+    buffer[:len(COPY_HEADER)] = COPY_HEADER
+    pos = len(COPY_HEADER)
     batch_count = 0
+    last_str = str(int(last_inserted)).encode()
+    last_len = len(last_str)
+    consumed = 0
+    last_number = None
     
-    for line in file_handle:
-        parts = line.strip().split()
-        if not parts:
+    for line in lines:
+        consumed += len(line) + 1
+        # Rows are "number factor factor ...", separated by single spaces
+        # Only the number is split off until the row is known to be new
+        cm_number, _, factors = line.rstrip().partition(b' ')
+        if not cm_number:
             continue
         
-        cm_number = parts[0].strip()
-        
         # Skip already processed
+        # Numbers are canonical digit strings, so shorter means smaller and equal lengths compare as text
         if processing:
-            if Decimal(cm_number) <= Decimal(last_inserted):
+            if len(cm_number) < last_len or (len(cm_number) == last_len and cm_number <= last_str):
                 continue
             else:
                 processing = False
         
-        factors = parts[1:]
-        factors_psql = '{' + ','.join(factors) + '}'
-        
         # Writes to STDIN, where copy reads from
-        buffer.write(f"{cm_number}\t{factors_psql}\n")
+        pos = encode_row(buffer, pos, cm_number, factors.split(b' ') if factors else [])
+        last_number = cm_number
         
         batch_count += 1
         
@@ -179,10 +308,16 @@ def get_batch(file_handle, last_inserted, processing):
         if batch_count >= (BATCH_SIZE):
             break
     
-    # IO pointer moves as you write new data to it, reset it
-    buffer.seek(0)
-    
-    return buffer, batch_count
+    # Slice assignment grows the buffer if the trailer runs past the end
+    buffer[pos:pos + len(COPY_TRAILER)] = COPY_TRAILER
+    pos += len(COPY_TRAILER)
+
+    # Hand COPY a copy of just the used region, so the shared buffer can be refilled
+    with memoryview(buffer) as view:
+        return BytesIO(view[:pos]), batch_count, consumed, last_number
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        close_pool()
\ No newline at end of file
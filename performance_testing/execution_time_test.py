@@ -31,6 +31,7 @@ import os
 
 sys.path.append(str(os.path.join(os.path.dirname(__file__), '..')))
 from connection.psql_client import PSQLClient
+from psycopg2 import Error as PSQLError
 from urllib.parse import quote_plus
 from pymongo import MongoClient
 
@@ -40,45 +41,179 @@ MONGO_DB_FILENAME = "mongodb_results.txt"
 
 TEST_DIR = "test_cases"
 NUMBER_OF_EXECUTIONS = 3
+WARMUP_EXECUTIONS = 1     # Untimed passes over every case before the saved executions
 OUTPUT_DIR = "database_results"
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S-%f"    # Result folder names, visualize.py parses them back with the same format
+WRITE_BUFFER_SIZE = 1 << 20     # Results are flushed to disk 1MB at a time
+SEPARATOR = '='*80 + '\n'
+
+# Server side prepared statements, parsed once per session and then only executed
+# The multi table UNION gets one statement for each starting factor count
+ONE_TABLE_STATEMENT = "one_table_stmt"
+ONE_TABLE_QUERY = """
+    SELECT number
+    FROM carmichael_number
+    WHERE factors @> $1
+"""
+MULTI_TABLE_STATEMENTS = {
+    prime_count: f"multi_table_stmt_{prime_count}" for prime_count in range(3, 15)
+}
+MULTI_TABLE_QUERIES = {
+    prime_count: "UNION ALL".join(
+        f"""
+            SELECT number FROM carmichael_number_{i} WHERE factors @> $1
+        """
+        for i in range(prime_count, 15)
+    )
+    for prime_count in range(3, 15)
+}
 
 
 load_dotenv(override=True)
-db_client = PSQLClient()
 mongo_client = MongoClient(
     f"mongodb://{quote_plus(os.getenv('MONGO_USER', ''))}" +
     f":{quote_plus(os.getenv('MONGO_PASSWORD', ''))}" +
     f"@{quote_plus(os.getenv('MONGO_HOST', ''))}:" + 
     f"{quote_plus(os.getenv('MONGO_PORT', ''))}/"
 )
+# Resolved once here instead of on every test case
+mongo_collection = mongo_client[os.getenv('DATABASE', '')]['carmichael_number']
+
+# Cases run one at a time on a single PostgreSQL session, the prepared statements live on it
+# Running them concurrently would add contention for the servers to every timing
+db_client = None
 
 
 def main () -> None:
     print("Database Tests Beginning!")
     print("...")
     try:
+        # The test cases don't change between executions, read and parse them once
+        test_cases = load_test_cases()
+        prewarm_tables()
+
+        for warmup_number in range(WARMUP_EXECUTIONS):
+            print("Warm up", warmup_number + 1)
+            warm_up(test_cases)
+
         for execution_number in range(NUMBER_OF_EXECUTIONS):
             print("Execution", execution_number + 1)
-            execute_tests()
+            execute_tests(test_cases)
     finally:
+        if db_client is not None:
+            db_client.close()
         mongo_client.close()
+
+
+def warm_up(test_cases: dict[str, list[list[int]]]) -> None:
+    """
+    Run every distinct case once on every implementation and throw the results away.
+    This opens the session and prepares its statements, and warms the
+    MongoDB cache and the pages pg_prewarm can't reach, so the saved executions
+    all start from the same state instead of the first one being a cold outlier.
+    """
+    cases = dict.fromkeys(tuple(case) for cases in test_cases.values() for case in cases)
+    for case in cases:
+        run_case(list(case))
+
+
+def prewarm_tables() -> None:
+    """
+    Load every carmichael table and its indexes into shared_buffers before timing,
+    so the first execution isn't the only one that reads them from disk.
+    Needs the pg_prewarm extension, without it the tests just start cold.
+    """
+    table_names = ["carmichael_number"] + [f"carmichael_number_{i}" for i in range(3, 15)]
+    query = """
+        SELECT SUM(pg_prewarm(relid::regclass))
+        FROM (
+            SELECT oid AS relid FROM pg_class WHERE relname = ANY(%s)
+            UNION ALL
+            SELECT indexrelid FROM pg_index
+            WHERE indrelid IN (SELECT oid FROM pg_class WHERE relname = ANY(%s))
+        ) AS relations
+    """
+
+    print("Prewarming tables...")
+    try:
+        with PSQLClient() as db_client:
+            pages = db_client.fetch_all(query, (table_names, table_names))[0][0]
+        print(f"Prewarmed {pages} pages.")
+    except PSQLError as e:
+        print(f"Skipping prewarm, is pg_prewarm installed? {e}")
+
+
+def get_db_client() -> PSQLClient:
+    """
+    Return the shared PSQLClient, opening it and
+    preparing the test statements the first time it's asked for.
+    """
+    global db_client
+    if db_client is None:
+        db_client = PSQLClient()
+        prepare_statements(db_client)
+    return db_client
         
 
-def execute_tests() -> None:
+def prepare_statements(db_client: PSQLClient) -> None:
+    """
+    PREPARE the one table and multi table queries on the client's session.
+    Every EXPLAIN ANALYZE EXECUTE after this skips parsing and rewriting the query.
+
+    Custom plans are forced so each execution is still planned for its own factors,
+    a generic plan can't estimate how selective the array containment is.
+    JIT is turned off so its compile time isn't counted in the execution time
+    of the scans that cross the JIT cost threshold.
+    """
+    statements = ["SET plan_cache_mode = force_custom_plan", "SET jit = off"]
+    statements.append(
+        f"PREPARE {ONE_TABLE_STATEMENT}(BIGINT[]) AS {ONE_TABLE_QUERY}"
+    )
+    for prime_count, statement in MULTI_TABLE_STATEMENTS.items():
+        statements.append(
+            f"PREPARE {statement}(BIGINT[]) AS {MULTI_TABLE_QUERIES[prime_count]}"
+        )
+
+    db_client.execute_multiple_queries(statements)
+
+
+def load_test_cases() -> dict[str, list[list[int]]]:
+    """
+    Read every test case file in TEST_DIR, parsing each case into its list of factors.
+    Returns the cases keyed by the test file name, in name order.
+    """
+    test_cases = {}
+
+    # scandir entries carry their file type from the directory read, so there's no stat per file
+    with os.scandir(TEST_DIR) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if not entry.is_file():
+                raise ValueError(f"Invalid path name found while iterating inside the files of {TEST_DIR}")
+
+            print(f"Reading {entry.name}...")
+            test_cases[entry.name] = read_test_case(entry.path)
+
+    return test_cases
+
+
+def execute_tests(test_cases: dict[str, list[list[int]]]) -> None:
     """
     Test scrips. For databases, it will run EXPLAIN ANALYZE or .explain() queries.
     The scripts are ran and saved to a text file.
+    Cases run one after another so no query's timing includes another one's load.
+    A case that shows up more than once in an execution is only queried the first time,
+    repeats reuse its results.
 
     We first create a directory for the tests based on the time this function begins.
 
     Then we create the files we will write to, this depends on how many tests we are running.
 
     For the current execution, there will be three tests ran every time. These tests run
-    through all the test cases located in the TEST_DIR constant.
+    through all the test cases loaded from the TEST_DIR constant.
 
     The query output of the analyze queries is combined and then saved onto a master text file.
     """
-    read_time = str(datetime.now()).replace(" ", "_").replace(":", "-").replace(".", "-")
+    read_time = datetime.now().strftime(TIMESTAMP_FORMAT)
     output_path = OUTPUT_DIR + "/" + read_time
     os.makedirs(output_path, exist_ok=True)
 
@@ -86,111 +221,116 @@ def execute_tests() -> None:
     multi_table_path = output_path + "/" + MULTI_TABLE_FILENAME
     mongo_collection_path = output_path + "/" + MONGO_DB_FILENAME
 
-    with open(one_table_path, 'w') as one_out, \
-         open(multi_table_path, 'w') as multi_out, \
-         open(mongo_collection_path, 'w') as mongo_out:
-        
-        for filename in os.listdir(TEST_DIR):
-            filepath = os.path.join(TEST_DIR, filename)
-
-            if not os.path.isfile(filepath):
-                raise ValueError(f"Invalid path name found while iterating inside the files of {TEST_DIR}")
-
-            print(f"Reading {filename}...")
-
-            one_out.write('='*80 + '\n')
-            one_out.write(f"TEST_NAME: {filename}\n")
-            
-            multi_out.write('='*80 + '\n')
-            multi_out.write(f"TEST_NAME: {filename}\n")
+    # Results of every case run so far in this execution
+    results = {}
 
-            mongo_out.write('='*80 + '\n')
-            mongo_out.write(f"TEST_NAME: {filename}\n")
+    with open(one_table_path, 'w', buffering=WRITE_BUFFER_SIZE) as one_out, \
+         open(multi_table_path, 'w', buffering=WRITE_BUFFER_SIZE) as multi_out, \
+         open(mongo_collection_path, 'w', buffering=WRITE_BUFFER_SIZE) as mongo_out:
+        
+        for filename, cases in test_cases.items():
+            test_header = f"{SEPARATOR}TEST_NAME: {filename}\n"
+            one_out.write(test_header)
+            multi_out.write(test_header)
+            mongo_out.write(test_header)
             
-            cases = read_test_case(filepath)
             print("Runnings tests on:", cases)
             print()
 
+            new_cases = [case for case in dict.fromkeys(map(tuple, cases)) if case not in results]
+            results.update(zip(new_cases, map(run_case, map(list, new_cases))))
+
             for idx, case in enumerate(cases):
-                print("Case:", case)
-                read_and_write_case(one_out, 'One Table', idx, case, run_one_table_explain)
-                read_and_write_case(multi_out, 'Multi Table', idx, case, run_multi_table_explain)
-                read_and_write_case(mongo_out, 'Mongo NoSQL', idx, case, run_mongo_col_explain)
+                one_result, multi_result, mongo_result = results[tuple(case)]
+                write_case(one_out, idx, one_result)
+                write_case(multi_out, idx, multi_result)
+                write_case(mongo_out, idx, mongo_result)
 
 
-def read_and_write_case(writer, name:str, index: int, test_case: str, func:callable) -> None:
+def run_case(test_case: list[int]) -> tuple[str, str, str]:
     """
     Controller function:
-        Run the query and format the results nicely, passed into the io streamer to write.
+        Run the case on every implementation, one after the other, returning each result.
+    """
+    print("Case:", test_case)
+    results = []
+    for name, func in (
+        ('One Table', run_one_table_explain),
+        ('Multi Table', run_multi_table_explain),
+        ('Mongo NoSQL', run_mongo_col_explain)
+    ):
+        print(f"Running {name.title()} Tests")
+        results.append(func(test_case))
+    return tuple(results)
+
+
+def write_case(writer, index: int, result: str) -> None:
+    """
+    Format the results nicely, passed into the io streamer to write in one call.
     """
-    print(f"Running {name.title()} Tests")
-    writer.write('='*80 + '\n')
-    writer.write(f"TEST_CASE_NUM: {index + 1}\n")
-    writer.write('='*80 + '\n')
-    writer.write(func(test_case))
-    writer.write('\n')
+    writer.write(f"{SEPARATOR}TEST_CASE_NUM: {index + 1}\n{SEPARATOR}{result}\n")
 
 
-def run_mongo_col_explain(factor_str:str) -> str:
+def run_mongo_col_explain(factors:list[int]) -> str:
     """
     Runs test query on mongo DB, returns the executionStats parameter
+    as compact JSON (on one line).
     """
-    factors = [int(factor) for factor in factor_str.split(',')]
-    result = mongo_client[os.getenv('DATABASE', '')]['carmichael_number']\
-        .find({"factors": {"$all": factors}}).explain()
+    result = mongo_collection.find({"factors": {"$all": factors}}).explain()
 
-    return json.dumps(result, indent=2, default=str)
+    return json.dumps(result, default=str)
     
 
-def run_multi_table_explain(factor_str:str) -> str:
+def run_multi_table_explain(factors:list[int]) -> str:
     """
     Run the EXPLAIN ANALYZE for multi-table.
-    The size of the string matters here.
-    
-    To save time processing we will count the
-    number of commas in the string.
-    So the number of factors is always number of commas + 1.
+    The number of factors matters here.
     
     Remember, the search starts at three, so before 3, 
-    we don't really care!
-    """
-    prime_count = max(3, factor_str.count(',') + 1)
+    we don't really care! Past 14 only the last table is searched.
 
-    query = "EXPLAIN ANALYZE"
-    for i in range(prime_count, 14):
-        query += f"""
-            SELECT number FROM carmichael_number_{i} WHERE factors @> ARRAY[{factor_str}]::BIGINT[]
-            UNION ALL
-        """
-    query += f"""
-    SELECT number FROM carmichael_number_14 WHERE factors @> ARRAY[{factor_str}]::BIGINT[]
+    The factors are bound once and shared by every table in the
+    prepared UNION, psycopg2 sends the list as an array literal.
     """
+    prime_count = min(max(3, len(factors)), 14)
 
-    return db_client.execute_query(query)
+    return run_sql_explain(MULTI_TABLE_STATEMENTS[prime_count], factors)
 
 
-def run_one_table_explain(factor_str:str) -> str:
+def run_one_table_explain(factors:list[int]) -> str:
     """
     Run the EXPLAIN ANALYZE query for the one table.
-    The values passed in should be a either a comma
-    separated list of numbers, or one number.
+    The values passed in should be a list of
+    one or more numbers.
+    """
+    return run_sql_explain(ONE_TABLE_STATEMENT, factors)
+
+
+def run_sql_explain(statement:str, factors:list[int]) -> str:
     """
-    query = f"""
-        EXPLAIN ANALYZE
-        SELECT number
-        FROM carmichael_number
-        WHERE factors @> ARRAY[{factor_str}]::BIGINT[];
+    EXPLAIN ANALYZE a prepared statement with the factors bound to it.
+    The plan comes back as JSON, which psycopg2 decodes, so it's
+    written out again as compact JSON (on one line).
+
+    Per node timing is off, reading the clock for every row slows the query down
+    and only the summary's planning and execution times are used.
     """
+    query = f"EXPLAIN (ANALYZE, TIMING OFF, SUMMARY ON, FORMAT JSON) EXECUTE {statement}(%s::BIGINT[])"
+    plan = get_db_client().fetch_all(query, (factors,))[0][0]
 
-    return db_client.execute_query(query)
+    return json.dumps(plan)
 
 
-def read_test_case(file_path:str) -> list[str]:
+def read_test_case(file_path:str) -> list[list[int]]:
     """
-    Read the data from the first test case. Return a 1d array.
+    Read the data from the first test case. Return a list of factor lists.
     The first file does not include the CN in the test,
     but every other file does, so the skip boolean is used here
     to omit the first number if required.
+
+    The factors are sorted and ready to be passed as a query parameter.
+    Sorting keeps the query text the same for the same set of factors,
+    whatever order they were written in.
     """
     if not file_path or not file_path.endswith('.txt'):
         raise ValueError("Please pass in a real path of a text file for the test case.")
@@ -199,11 +339,11 @@ def read_test_case(file_path:str) -> list[str]:
     cases = []
 
     with open(file_path) as f:
-        for line in f.readlines():
-            if first_file:
-                cases.append(line.strip())
-            else:
-                cases.append(', '.join(line.split(" ")[1:]).strip())
+        for line in f:
+            numbers = line.split()
+            if not numbers:
+                continue
+            cases.append(sorted(map(int, numbers if first_file else numbers[1:])))
         
     return cases
 
@@ -1,7 +1,7 @@
 """
 Data Visualization File
 
-This file will read the test results from sql_test.py and potentially other
+This file will read the test results from execution_time_test.py and potentially other
 files that are used for testing to then output the results into specialized
 visualizations. All test results are compared against a baseline, which is
 a text parser that was used prior to this. The baseline is hardcoded as a
@@ -24,17 +24,23 @@ the output pat specialized as a constant.
 
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
-import json
+import numpy as np
+import os
 import pandas as pd
 import re
 
 from pathlib import Path
 from datetime import datetime
-from math import ceil, log10
 
 from matplotlib.axes import Axes
 from matplotlib.colors import to_rgba
 
+# orjson decodes the explain documents several times faster, use it when installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 TEST_DIR = "database_results"
 DATE = "2025-12-12"
 IMG_DIR = "visualizations/" + DATE
@@ -43,8 +49,28 @@ MULTI_TABLE_FILENAME = "multi_table_results.txt"
 MONGO_COLLECTION_FILENAME = "mongodb_results.txt"
 TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S-%f"
 TEST_BASELINE_MS = 265000
+# The report uses 300 dpi PNGs, set VIZ_DPI lower for quick previews or
+# VIZ_FORMAT=svg to skip rasterizing altogether
+OUTPUT_DPI = int(os.getenv('VIZ_DPI', '300'))
+OUTPUT_FORMAT = os.getenv('VIZ_FORMAT', 'png')
+RESULT_COLUMNS = ("schema", "timestamp", "name", "case_num", "factors", "total_time_ms")
+
+# Patterns used by the result parsers, compiled once and each matched in a single
+# scan of the file. The name of the group that matched tells the parser which marker
+# it found. The headers are matched from TEST_ rather than from the separator line
+# before them, so the regex engine can jump between literal prefixes instead of
+# trying a match at every '=' of the separators.
+RESULT_HEADER_RE = re.compile(r"TEST_NAME:(?P<name>.*)|TEST_CASE_NUM:\s*(?P<case_num>\d*)")
+SQL_RESULT_RE = re.compile(
+    r"TEST_NAME:(?P<name>.*)"
+    r"|TEST_CASE_NUM:\s*(?P<case_num>\d*)"
+    r"|{(?P<factors>[\d,]*\d)}"
+    r"|Planning Time\"?:\s*(?P<planning_time>[\d.]+)"
+    r"|Execution Time\"?:\s*(?P<execution_time>[\d.]+)"
+)
 
 image_counter = 0
+figures = {}    # One figure per grid layout, cleared and redrawn by every create_grid call
 
 plt.style.use('ggplot')
 plt.rcParams.update({
@@ -97,22 +123,27 @@ def create_grid(
         - improvement: If you are visualizing an improvement metric
     """
 
+    fig, axes = get_figure(1 if improvement else 2)
+
+    # Both plots in the grid show the same numbers, so aggregate them once
+    aggregated = aggregate(df, gb_col, val_col)
+
     if improvement:
-        fig, axes = plt.subplots(1, 1, figsize=(5, 4))
         visualize(
             df=df,
             gb_col=gb_col,
             val_col=val_col,
             baseline=False,
-            ax=axes
+            ax=axes,
+            aggregated=aggregated
         )
     else:
-        fig, axes = plt.subplots(1, 2, figsize=(10, 4))
         visualize(
             df=df,
             gb_col=gb_col,
             val_col=val_col,
-            ax=axes[0]
+            ax=axes[0],
+            aggregated=aggregated
         )
         visualize(
             df=df,
@@ -121,7 +152,8 @@ def create_grid(
             baseline=False,
             y_label=False,
             legend=False,
-            ax=axes[1]
+            ax=axes[1],
+            aggregated=aggregated
         )
 
     fig.suptitle(title, fontsize=18, x=0, ha='left')
@@ -129,14 +161,33 @@ def create_grid(
     fig.subplots_adjust(top=0.85)
 
     global image_counter
-    plt.savefig(
-        f'{IMG_DIR}/{image_counter:02d}_{title.replace(' ','_').lower()}.png',
-        dpi=300,
+    fig.savefig(
+        f'{IMG_DIR}/{image_counter:02d}_{title.replace(' ','_').lower()}.{OUTPUT_FORMAT}',
+        dpi=OUTPUT_DPI,
         bbox_inches='tight'
     )
     image_counter += 1
 
 
+def get_figure(columns: int) -> tuple:
+    """
+    Helper function that hands back the figure and axes for a grid with the
+    given number of columns. The figure is only created the first time, after
+    that its axes and texts are cleared so the next grid can be drawn on it.
+    """
+    if columns not in figures:
+        figures[columns] = plt.subplots(1, columns, figsize=(5 * columns, 4))
+        return figures[columns]
+
+    fig, axes = figures[columns]
+    for ax in fig.axes:
+        ax.clear()
+    for text in list(fig.texts):
+        text.remove()
+
+    return fig, axes
+
+
 def visualize(
         df:pd.DataFrame,
         gb_col:str,
@@ -146,12 +197,14 @@ def visualize(
         legend:bool = True,
         agg_type:str = 'mean',
         ax:Axes=None,
+        aggregated:pd.DataFrame = None,
     ) -> None:
     """
     Function created to visualize a variable specified.
     Uses a group by operation to group the schemas together,
     then it's aggregated by the passed in aggregation function,
         This must be a Pandas series function.
+    If the aggregate was already computed by the caller it is reused.
 
     There is a special case to show the baseline value if required.
         When this is false, it will omit showing the line,
@@ -163,11 +216,12 @@ def visualize(
     if ax is None:
         ax = plt.subplot()
 
-    for schema, group in df.groupby('schema'):
-        avg_by_factors = group\
-            .groupby(gb_col)[val_col]\
-            .agg(agg_type)
-        
+    if aggregated is None:
+        aggregated = aggregate(df, gb_col, val_col, agg_type)
+
+    for schema in aggregated.columns:
+        avg_by_factors = aggregated[schema].dropna()
+
         ax.plot(
             avg_by_factors.index, 
             avg_by_factors.values, 
@@ -194,13 +248,14 @@ def visualize(
         )
 
     if y_label:
-        ax.set_ylabel(clean_names(avg_by_factors.name))
+        ax.set_ylabel(clean_names(val_col))
 
     # If the x labels are long we'll clean them and rotate for readability
-    if max(len(str(label)) for label in df[gb_col].unique()) > 3:
-        labels = [clean_names(str(label)) for label in df[gb_col].unique()]
+    # The aggregated index already holds each group once, in plotting order
+    labels = aggregated.index.astype(str)
+    if labels.str.len().max() > 3:
         ax.set_xticks(range(len(labels)))
-        ax.set_xticklabels(labels, rotation=45, ha='right')
+        ax.set_xticklabels([clean_names(label) for label in labels], rotation=45, ha='right')
     
     # If neither are true then this is a secondary viz
     # Therefore it has room for a subtitle
@@ -213,6 +268,23 @@ def visualize(
     ax.yaxis.set_major_formatter(ticker.FuncFormatter(ms_to_s))     # Converts the displayed amount to seconds from ms
 
 
+def aggregate(
+        df:pd.DataFrame,
+        gb_col:str,
+        val_col:str,
+        agg_type:str = 'mean',
+    ) -> pd.DataFrame:
+    """
+    Helper function that aggregates the value column for every schema in
+    a single group by. Returns a table indexed by the group by column with
+    one column per schema, missing groups are left as NaN.
+    """
+    return df\
+        .groupby(['schema', gb_col])[val_col]\
+        .agg(agg_type)\
+        .unstack(level=0)
+
+
 def clean_names(name: str) -> str:
     """
     Helper function used to sanitize the column names for visualizing.
@@ -234,45 +306,55 @@ def ms_to_s(val: int, pos:int) -> str:
 
 
 def display_summary_stats(df:pd.DataFrame) -> None:
+    # One grouping pass computes all three aggregates
+    stats = df.groupby(['schema'])['total_time_ms'].agg(['mean', 'max', 'min'])
+
     print("\nOverall statistic from all tests:")
     print("\nTable Averages")
-    print(df.groupby(['schema'])['total_time_ms'].mean())
+    print(stats['mean'].rename('total_time_ms'))
     print("\nTable Maximums")
-    print(df.groupby(['schema'])['total_time_ms'].max())
+    print(stats['max'].rename('total_time_ms'))
     print("\nTable Minimums")
-    print(df.groupby(['schema'])['total_time_ms'].min())
+    print(stats['min'].rename('total_time_ms'))
     print()
 
 
-def collect_and_parse_data() -> list[list[dict]]:
+def collect_and_parse_data() -> dict[str, list]:
     """
     Loop through the test directory, collect each folder name as the timestamp.
-    Return the entirety of all the parsed data in the directory.
+    Return the entirety of all the parsed data in the directory, as one list
+    per column so pandas can build the dataframe without transposing rows.
     """
-    folder = Path(TEST_DIR)
+    results = {column: [] for column in RESULT_COLUMNS}
+
+    # scandir hands back the entry type with the name, so no extra stat per entry
+    with os.scandir(TEST_DIR) as entries:
+        for item in entries:
+            if not item.is_dir():
+                continue
+
+            # Only take the results from the day were interested on
+            if not item.name.startswith(DATE):
+                continue
+
+            # The folder name is parsed once and shared by every row in its files
+            timestamp = datetime.strptime(item.name, TIMESTAMP_FORMAT)
+            folder = Path(item.path)
+
+            # Add the results from both schemata
+            parse_SQL_explain(folder / ONE_TABLE_FILENAME, timestamp, "One Table", results)
+            parse_SQL_explain(folder / MULTI_TABLE_FILENAME, timestamp, "Multi Table", results)
+            parse_MDB_explain(folder / MONGO_COLLECTION_FILENAME, timestamp, "Mongo DB", results)
 
-    results = []
-    for item in folder.iterdir():
-        if not item.is_dir():
-            continue
-        
-        # Only take the results from the day were interested on
-        if not item.name.startswith(DATE):
-            continue
-        
-        # Add the results from both schemata
-        results += parse_SQL_explain(item / ONE_TABLE_FILENAME, item.name, "One Table")
-        results += parse_SQL_explain(item / MULTI_TABLE_FILENAME, item.name, "Multi Table")
-        results += parse_MDB_explain(item / MONGO_COLLECTION_FILENAME, item.name, "Mongo DB")
-    
     return results
 
 
 def parse_MDB_explain(
         path: Path, 
-        test_timestamp: str, 
-        testing_schema: str
-    ) -> list[dict]:
+        test_timestamp: datetime, 
+        testing_schema: str,
+        results: dict[str, list]
+    ) -> None:
     """
     NoSQL explain parser.
 
@@ -286,109 +368,108 @@ def parse_MDB_explain(
 
     We are interested in getting the factors from the query, the optimization time
     and the execution time. The sum of these two is our total time.
-    """
-    results = []
 
+    Each case is appended onto the column lists in results.
+    """
     with open(path, 'r', encoding='utf-8') as f:
         text = f.read()
 
-    test_blocks = re.split(r"=+\s*TEST_NAME:", text)[1:]
-    for block in test_blocks:
-        name_match = re.search(r"(.*?)\n=+", block)
-        test_name = name_match.group(1).strip() if name_match else None
-
-        case_blocks = re.split(r"=+\s*TEST_CASE_NUM:", block)[1:]
+    # Find every header in one scan, a case's block runs up to the next header
+    headers = list(RESULT_HEADER_RE.finditer(text))
+    test_name = None
+    for header, next_header in zip(headers, headers[1:] + [None]):
+        if header.lastgroup == "name":
+            test_name = header.group("name").strip()
+            continue
 
-        for case_block in case_blocks:
-            case_match = re.search(r"(\d+)", case_block)
-            case_num = int(case_match.group(1)) if case_match else None
+        case_num = int(header.group("case_num")) if header.group("case_num") else None
+        case_block = text[header.end():next_header.start() if next_header else len(text)]
 
-            # Parse the json results from the .explain query
-            json_start = case_block.find('\n', case_block.find('='))
-            data = json.loads(case_block[json_start:].strip()) if json_start else None
+        # Parse the json results from the .explain query, it sits between
+        # the separator under this header and the one above the next header
+        json_start = case_block.find('\n', case_block.find('='))
+        data = json_loads(case_block[json_start:].rstrip().rstrip('=')) if json_start else None
 
-            planning_time = float(data['queryPlanner']['optimizationTimeMillis']) if data else None
-            execution_time = float(data['executionStats']['executionTimeMillis']) if data else None
+        planning_time = float(data['queryPlanner']['optimizationTimeMillis']) if data else None
+        execution_time = float(data['executionStats']['executionTimeMillis']) if data else None
 
-            parsed_query = data['queryPlanner']['parsedQuery'] if data else None
+        parsed_query = data['queryPlanner']['parsedQuery'] if data else None
 
-            # Multi case if there are multiple factors
-            if parsed_query:
-                if '$and' in parsed_query:
-                    factors_str = ','.join(
-                        str(e['factors']['$eq']) for e in parsed_query['$and']
-                    )
-                else:
-                    factors_str = str(parsed_query['factors']['$eq'])
+        # Multi case if there are multiple factors
+        if parsed_query:
+            if '$and' in parsed_query:
+                factors_str = ','.join(
+                    str(e['factors']['$eq']) for e in parsed_query['$and']
+                )
             else:
-                factors_str = None
-
-            results.append({
-                "schema": testing_schema,
-                "timestamp": datetime.strptime(test_timestamp, TIMESTAMP_FORMAT),
-                "name": test_name,
-                "case_num": case_num,
-                "factors": factors_str,
-                "total_time_ms": planning_time + execution_time if planning_time is not None and execution_time is not None else None
-            })
-        
-    return results
+                factors_str = str(parsed_query['factors']['$eq'])
+        else:
+            factors_str = None
+
+        results["schema"].append(testing_schema)
+        results["timestamp"].append(test_timestamp)
+        results["name"].append(test_name)
+        results["case_num"].append(case_num)
+        results["factors"].append(factors_str)
+        results["total_time_ms"].append(
+            planning_time + execution_time if planning_time is not None and execution_time is not None else None
+        )
 
 
 def parse_SQL_explain(
         path: Path, 
-        test_timestamp: str, 
-        testing_schema: str
-    ) -> list[dict]:
+        test_timestamp: datetime, 
+        testing_schema: str,
+        results: dict[str, list]
+    ) -> None:
     """
-    Parse the results of the tests analyze splitting the file into individual
-    test blocks, and then looking for key elements in the text.
+    Parse the results of the tests analyze by scanning the file once for the
+    test and case headers, and then the key elements that follow each case.
 
     What we are interested in;
         - The planning time,
         - The execution time, and
         - The time of algorithm used.
 
+    The plans are either psql's text output (Planning Time: 0.1 ms) or
+    EXPLAIN's JSON format ("Planning Time": 0.1), the patterns accept both.
+    Only the first match of each element inside a case is kept.
+
     The last one becomes tricky to implement since the UNION query uses multiple
     algorithms per part of the UNION, so we'll omit it for now.
 
-    Returns, a list of dictionaries of the data parsed.
+    Each case is appended onto the column lists in results.
     """
-    results = []
-    
     with open(path, "r", encoding="utf-8") as f:
         text = f.read()
 
-    test_blocks = re.split(r"=+\s*TEST_NAME:", text)[1:]
-    for block in test_blocks:
-        name_match = re.search(r"(.*?)\n=+", block)
-        test_name = name_match.group(1).strip() if name_match else None
-
-        case_blocks = re.split(r"=+\s*TEST_CASE_NUM:", block)[1:]
-
-        for case_block in case_blocks:
-            case_match = re.search(r"(\d+)", case_block)
-            case_num = int(case_match.group(1)) if case_match else None
-
-            factors_match = re.search(r"({[\d,]*\d})", case_block)
-            factors_str = factors_match.group(1).strip("{}") if factors_match else None
-
-            plan_match = re.search(r"Planning Time:\s*([\d.]+)\s*ms", case_block)
-            planning_time = float(plan_match.group(1)) if plan_match else None
-
-            exec_match = re.search(r"Execution Time:\s*([\d.]+)\s*ms", case_block)
-            execution_time = float(exec_match.group(1)) if exec_match else None
-
-            results.append({
-                "schema": testing_schema,
-                "timestamp": datetime.strptime(test_timestamp, TIMESTAMP_FORMAT),
-                "name": test_name,
-                "case_num": case_num,
-                "factors": factors_str,
-                "total_time_ms": planning_time + execution_time if planning_time is not None and execution_time is not None else None
-            })
-
-    return results
+    # Walk the markers in file order, a new test or case header closes the current case
+    cases = []
+    case = None
+    test_name = None
+    for match in SQL_RESULT_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == "name":
+            test_name = match.group(kind).strip()
+            case = None
+        elif kind == "case_num":
+            case = {"name": test_name, "case_num": match.group(kind)}
+            cases.append(case)
+        elif case is not None and kind not in case:
+            case[kind] = match.group(kind)
+
+    for case in cases:
+        planning_time = float(case["planning_time"]) if "planning_time" in case else None
+        execution_time = float(case["execution_time"]) if "execution_time" in case else None
+
+        results["schema"].append(testing_schema)
+        results["timestamp"].append(test_timestamp)
+        results["name"].append(case["name"])
+        results["case_num"].append(int(case["case_num"]) if case["case_num"] else None)
+        results["factors"].append(case.get("factors"))
+        results["total_time_ms"].append(
+            planning_time + execution_time if planning_time is not None and execution_time is not None else None
+        )
 
 
 def transform_data(df:pd.DataFrame) -> None:
@@ -398,22 +479,23 @@ def transform_data(df:pd.DataFrame) -> None:
     DataFrame's are not primative types, therefore, they are edited in
     memory. Nothing to return.
     """
-    df["improvement_ms"] = TEST_BASELINE_MS - df["total_time_ms"]
-    df["improvement_percent"] = df["improvement_ms"] / TEST_BASELINE_MS
-    df["num_of_factors"] = df["factors"].str.count(",") + 1
+    # The factor lists are parsed once into a single integer column (one row per
+    # factor, keeping the test's index), every factor column is reduced from it
+    factors = df["factors"].str.split(",").explode().astype("int64").groupby(level=0)
+
+    # Plain array arithmetic, the columns share the dataframe's index anyway
+    improvement_ms = TEST_BASELINE_MS - df["total_time_ms"].to_numpy()
+    df["improvement_ms"] = improvement_ms
+    df["improvement_percent"] = improvement_ms / TEST_BASELINE_MS
+    df["num_of_factors"] = factors.size()
 
     # Get the min magnitude and max magnitude of each number in the tests
-    df["min_ord_mag10"] = df["factors"].apply(
-        lambda x: ceil(log10(min([int(p) for p in x.split(",")])))
-    )
-    df["max_ord_mag10"] = df["factors"].apply(
-        lambda x: ceil(log10(max([int(p) for p in x.split(",")])))
-    )
+    df["min_ord_mag10"] = np.ceil(np.log10(factors.min())).astype("int64")
+    df["max_ord_mag10"] = np.ceil(np.log10(factors.max())).astype("int64")
 
     # Balanced if the order of magnitudes equal from min to max
-    df["balanced"] = df.apply(
-        lambda x: "Balanced" if x["min_ord_mag10"] == x["max_ord_mag10"] else "Unbalanced",
-        axis=1
+    df["balanced"] = np.where(
+        df["min_ord_mag10"].values == df["max_ord_mag10"].values, "Balanced", "Unbalanced"
     )
 
     # Sort the table by timestamp (asc), name (asc), case_num (asc), schema (asc)